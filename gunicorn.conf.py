@@ -0,0 +1,24 @@
+"""gunicorn settings for production: `gunicorn app:app` picks this file up automatically."""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Summaries (waiting on OpenAI) and transcription streams (long-lived SSE connections)
+# are I/O-bound, so each worker serves many requests on threads. PDF extraction has its
+# own process pool. Keep one worker unless sessions move out of process memory: every
+# request for a transcription session must reach the process that created it.
+# Each live recording holds two threads for its whole duration (the audio WebSocket
+# and the transcript SSE stream), so the thread count caps concurrent recordings at
+# about threads / 2, with /summarize and uploads queueing behind them.
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "64"))
+
+# Import the app once in the master and fork workers from it, so imported modules are
+# shared copy-on-write and import errors surface before any worker starts.
+preload_app = True
+
+# Worker heartbeat files go to RAM when available; a disk-backed /tmp can stall them.
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"